@@ -83,6 +83,10 @@ DATABASES = {
   "default": {
     "ENGINE": "django.db.backends.sqlite3",
     "NAME": os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+    "TEST": {
+      # File-backed, so tests running concurrent requests see SQLite's real locking
+      "NAME": os.path.join(BASE_DIR, 'test_db.sqlite3'),
+    },
   }
 }
 
@@ -129,6 +133,12 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Upload handlers hash files while they are received (see files/uploadhandler.py)
+FILE_UPLOAD_HANDLERS = [
+    'files.uploadhandler.HashingMemoryFileUploadHandler',
+    'files.uploadhandler.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -148,6 +158,9 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     
 }
+# LocMemCache is private to each process: cached file types and storage stats are only
+# invalidated in the process that handled the change. Keep the single gunicorn worker, or
+# switch to a shared backend such as Redis or Memcached before adding workers.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
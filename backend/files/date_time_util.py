@@ -4,6 +4,7 @@ import time
 # Define base epoch as January 1, 2025 00:00:00 UTC
 BASE_EPOCH = datetime(2025, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
 BASE_EPOCH_TIMESTAMP = int(BASE_EPOCH.timestamp())
+BASE_EPOCH_TIMESTAMP_MS = BASE_EPOCH_TIMESTAMP * 1000
 
 def datetime_to_epoch_ms(dt):
     """
@@ -17,8 +18,9 @@ def datetime_to_epoch_ms(dt):
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=timezone.utc)
         
-    # Calculate milliseconds since our base epoch
-    return int((dt.timestamp() - BASE_EPOCH_TIMESTAMP) * 1000)
+    # Calculate milliseconds since our base epoch using exact integer arithmetic
+    delta = dt - BASE_EPOCH
+    return delta.days * 86_400_000 + delta.seconds * 1000 + delta.microseconds // 1000
 
 def epoch_ms_to_datetime(epoch_ms):
     """
@@ -31,8 +33,23 @@ def epoch_ms_to_datetime(epoch_ms):
     timestamp = BASE_EPOCH_TIMESTAMP + (epoch_ms / 1000)
     return datetime.fromtimestamp(timestamp, tz=timezone.utc)
 
+def epoch_ms_to_iso(epoch_ms):
+    """
+    Convert milliseconds since our custom epoch to an ISO 8601 UTC string
+    without building a datetime object
+    """
+    if epoch_ms is None:
+        return None
+    
+    total_seconds, ms = divmod(epoch_ms + BASE_EPOCH_TIMESTAMP_MS, 1000)
+    t = time.gmtime(total_seconds)
+    return "%04d-%02d-%02dT%02d:%02d:%02d.%03dZ" % (
+        t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, ms
+    )
+
 def now_epoch_ms():
     """
     Get the current time as milliseconds since our custom epoch
     """
-    return datetime_to_epoch_ms(datetime.now(timezone.utc))
\ No newline at end of file
+    # Integer nanoseconds from the clock, no datetime object needed
+    return time.time_ns() // 1_000_000 - BASE_EPOCH_TIMESTAMP_MS
\ No newline at end of file
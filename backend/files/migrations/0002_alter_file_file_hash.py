@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-15 22:11
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file_hash',
+            field=models.CharField(db_index=True, default=uuid.uuid4, max_length=64, unique=True),
+        ),
+    ]
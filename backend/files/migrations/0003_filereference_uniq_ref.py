@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-15 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_alter_file_file_hash'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='filereference',
+            constraint=models.UniqueConstraint(fields=('reference_file', 'original_filename', 'uploaded_at_epoch'), name='uniq_ref'),
+        ),
+    ]
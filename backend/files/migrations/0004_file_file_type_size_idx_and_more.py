@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-15 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0003_filereference_uniq_ref'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['file_type', '-size'], name='file_type_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filereference',
+            index=models.Index(fields=['reference_file', '-uploaded_at_epoch'], name='fr_refuploaded_idx'),
+        ),
+    ]
@@ -1,24 +1,53 @@
 import uuid
 import os
 import hashlib
-from venv import logger
+import logging
 from django.utils import timezone
+from django.core.cache import cache
 from django.db import models, transaction
+from django.db.models import F
 from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
 from .date_time_util import now_epoch_ms
 
+logger = logging.getLogger(__name__)
+
+# Cache key for the distinct File.file_type list; cleared whenever a File is saved or deleted
+FILE_TYPES_CACHE_KEY = 'file_types_v1'
+# Cache key for the storage_stats response; cleared whenever a File or FileReference changes
+STORAGE_STATS_CACHE_KEY = 'ss_v1'
+
 
 """
     Creating multiple tables because, otherwise we'll have to store the metadata multiple times, 
     since we're using sha256 for hash, it's 256 bits, i.e., 32 bytes, which is a lot of space.
     And considering
 """
+# Read uploads in 1MB chunks so the per-chunk Python -> C call overhead of update() is amortized
+HASH_CHUNK_SIZE = 1024 * 1024
+
 def calculate_file_hash(file):
-    """Calculate MD5 hash for a file."""
-    hash_func = hashlib.sha256()
-    for chunk in file.chunks():
-        hash_func.update(chunk)
+    """Calculate SHA-256 hash for a file."""
+    raw_file = getattr(file, 'file', None)
+    if hasattr(raw_file, 'readinto'):
+        raw_file.seek(0)
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: the whole read/update loop runs in C
+            hash_func = hashlib.file_digest(raw_file, 'sha256')
+        else:
+            # Read into one reusable buffer and hash a memoryview of it, so no bytes object is allocated per chunk
+            hash_func = hashlib.sha256()
+            buf = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while True:
+                n = raw_file.readinto(buf)
+                if not n:
+                    break
+                hash_func.update(view[:n])
+    else:
+        hash_func = hashlib.sha256()
+        for chunk in file.chunks(chunk_size=HASH_CHUNK_SIZE):
+            hash_func.update(chunk)
     file.seek(0)  # Reset file pointer to the beginning to prevent from any data-loss/error in figuring out the hash
     return hash_func.hexdigest()
 
@@ -34,24 +63,48 @@ def file_upload_path(instance, filename):
         instance.file_hash + extension
     )
 
+def remove_stored_file(file_path, file_hash):
+    """Delete a stored upload and prune the hash directories it leaves empty"""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logger.error(f"Error cleaning up file {file_hash}: {e}")
+        return
+    
+    # Clean up the two hash directories (uploads/<hash[:4]>/<hash[4:8]>) if they are now empty,
+    # rmdir refuses a non-empty directory, so there is no need to list it first
+    hash_dir = os.path.dirname(file_path)
+    for directory in (hash_dir, os.path.dirname(hash_dir)):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+
+def delete_uncommitted_blob(file_instance):
+    """
+    Delete the blob FileField.pre_save wrote for a File whose row insert was rolled back.
+    Storage never overwrites an existing name, so this can't touch another File's blob.
+    """
+    if file_instance.file and file_instance.file._committed:
+        file_instance.file.storage.delete(file_instance.file.name)
+
 #class for unique files that we have found till now
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    file_hash = models.CharField(max_length=32, unique=True, db_index=True, default=uuid.uuid4)
+    file_hash = models.CharField(max_length=64, unique=True, db_index=True, default=uuid.uuid4)
     file = models.FileField(upload_to=file_upload_path)
     file_type = models.CharField(max_length=100)
     size = models.BigIntegerField(db_index=True)
     reference_count = models.PositiveIntegerField(default=0)
 
-    temp_original_filename = None  # Class attribute for temporary storage
-    
-    def __init__(self, *args, **kwargs):
-        # Extract original_filename if provided in kwargs
-        self.temp_original_filename = kwargs.pop('original_filename', None)
-        super().__init__(*args, **kwargs)
-    
     class Meta:
         ordering = ['-size']
+        indexes = [
+            # Type filter combined with size ordering/range can be served from the index
+            models.Index(fields=['file_type', '-size'], name='file_type_size_idx'),
+        ]
     
     def __str__(self):
         return self.file_hash
@@ -65,27 +118,11 @@ class File(models.Model):
     
 
 @receiver(post_save, sender=File)
-def create_initial_file_reference(sender, instance, created, **kwargs):
-    """
-    Create an initial FileReference when a new File is created.
-    This ensures every File has at least one reference.
-    """
-    if created:  # Only create reference if this is a new File
-        try:
-            # Use the stored original filename if available, otherwise fallback to file path
-            original_filename = instance.temp_original_filename or instance.file.name.split('/')[-1]
-                
-            # Create the reference
-            with transaction.atomic():
-                FileReference.objects.create(
-                    reference_file=instance,
-                    original_filename=original_filename
-                )
-        except Exception as e:
-            print(f"Error creating initial file reference: {e}")
-            # You might want to delete the File if reference creation fails
-            instance.delete()
-            raise
+@receiver(post_delete, sender=File)
+def invalidate_file_types_cache(sender, **kwargs):
+    """The set of file types can only change when a File is written or removed"""
+    # Clear only once the change is visible, otherwise a concurrent read could re-cache the old list
+    transaction.on_commit(lambda: cache.delete(FILE_TYPES_CACHE_KEY))
 
 
 class FileReference(models.Model):
@@ -96,6 +133,17 @@ class FileReference(models.Model):
     
     class Meta:
         ordering = ['-uploaded_at_epoch']
+        indexes = [
+            # Newest-first listing of a file's references without a separate sort step
+            models.Index(fields=['reference_file', '-uploaded_at_epoch'], name='fr_refuploaded_idx'),
+        ]
+        constraints = [
+            # Rejects duplicate references from a retried upload request
+            models.UniqueConstraint(
+                fields=['reference_file', 'original_filename', 'uploaded_at_epoch'],
+                name='uniq_ref',
+            ),
+        ]
         
     
     def __str__(self):
@@ -104,11 +152,15 @@ class FileReference(models.Model):
     def save(self, *args, **kwargs):
         """Override save to handle reference count increment"""
         is_new = self._state.adding  # Check if this is a new instance
-        if is_new:  # Only increment if this is a new reference
+        if is_new and self.reference_file_id:  # Only increment if this is a new reference
             with transaction.atomic():
-                self.reference_file.reference_count += 1
-                self.reference_file.save()
-        super().save(*args, **kwargs)
+                # Single UPDATE by primary key, without loading or re-saving the referenced File
+                File.objects.filter(pk=self.reference_file_id).update(
+                    reference_count=F('reference_count') + 1
+                )
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
     
 @receiver(post_delete, sender=FileReference)
 def update_file_reference_count(sender, instance, **kwargs):
@@ -117,37 +169,35 @@ def update_file_reference_count(sender, instance, **kwargs):
     If reference count becomes zero, delete the File and its physical file.
     """
     with transaction.atomic():
-        file = instance.reference_file
+        file_id = instance.reference_file_id
         
-        # Store file information before any changes
-        file_path = file.file.path if file.file else None
-        file_hash = file.file_hash
+        # Decrement reference count in the database so concurrent deletes don't lose updates
+        File.objects.filter(pk=file_id, reference_count__gt=0).update(
+            reference_count=F('reference_count') - 1
+        )
         
-        # Decrement reference count
-        file.reference_count -= 1
+        # Only a File with no references left needs to be loaded
+        file = File.objects.filter(pk=file_id, reference_count__lte=0).first()
         
-        if file.reference_count <= 0:
-            try:
-                # First delete the physical file if it exists
-                if file_path and os.path.exists(file_path):
-                    os.remove(file_path)
-                    
-                    # Clean up empty directories
-                    directory = os.path.dirname(file_path)
-                    while directory.endswith(('uploads', file_hash[:4], file_hash[4:8])):
-                        try:
-                            if os.path.exists(directory) and not os.listdir(directory):
-                                os.rmdir(directory)
-                            directory = os.path.dirname(directory)
-                        except OSError:
-                            break
-                
-                # Now delete the File instance
-                File.objects.filter(id=file.id).delete()
-                
-            except Exception as e:
-                logger.error(f"Error cleaning up file {file_hash}: {e}")
-                raise  # Re-raise to trigger transaction rollback
-        else:
-            # Just save the updated reference count
-            file.save(update_fields=['reference_count'])
\ No newline at end of file
+        if file is not None:
+            # Store file information before any changes
+            file_path = file.file.path if file.file else None
+            file_hash = file.file_hash
+            
+            # Remove the physical file only once the row deletion has committed,
+            # so a rollback never leaves a File pointing at a missing blob
+            if file_path:
+                transaction.on_commit(lambda: remove_stored_file(file_path, file_hash))
+            
+            # Now delete the File instance
+            File.objects.filter(id=file.id).delete()
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+@receiver(post_save, sender=FileReference)
+@receiver(post_delete, sender=FileReference)
+def invalidate_storage_stats_cache(sender, **kwargs):
+    """Sizes and reference counts change whenever a File or FileReference is written or removed"""
+    # Clear only once the change is visible, otherwise a concurrent read could re-cache the old totals
+    transaction.on_commit(lambda: cache.delete(STORAGE_STATS_CACHE_KEY))
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import File, FileReference
-from .date_time_util import epoch_ms_to_datetime
+from .date_time_util import epoch_ms_to_iso
 
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,7 +28,4 @@ class FileReferenceSerializer(serializers.ModelSerializer):
 
     def get_uploaded_at(self, obj):
         """Convert the epoch timestamp to ISO format datetime string"""
-        dt = epoch_ms_to_datetime(obj.uploaded_at_epoch)
-        if dt:
-            return dt.isoformat()
-        return None
\ No newline at end of file
+        return epoch_ms_to_iso(obj.uploaded_at_epoch)
\ No newline at end of file
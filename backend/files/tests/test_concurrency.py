@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from django.db import connection
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+from django.core.files.uploadedfile import SimpleUploadedFile
+from files.models import File, FileReference
+
+THREADS = 4
+ROUNDS = 10
+
+class ConcurrentUploadTests(TransactionTestCase):
+    """Uploads running in parallel threads against the file-backed SQLite test database"""
+
+    def _run_in_threads(self, upload):
+        def worker(thread):
+            try:
+                return [upload(APIClient(), thread, round_) for round_ in range(ROUNDS)]
+            finally:
+                # Each thread opens its own database connection
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = list(executor.map(worker, range(THREADS)))
+        return [status_code for statuses in results for status_code in statuses]
+
+    def test_concurrent_uploads_of_distinct_files(self):
+        """Test that parallel uploads of different content all succeed"""
+        def upload(client, thread, round_):
+            content = f'distinct content {thread}-{round_}'.encode()
+            upload = SimpleUploadedFile(name=f'{thread}-{round_}.txt', content=content, content_type='text/plain')
+            return client.post('/api/files/', {'file': upload}, format='multipart').status_code
+
+        self.assertEqual(self._run_in_threads(upload), [201] * THREADS * ROUNDS)
+        self.assertEqual(File.objects.count(), THREADS * ROUNDS)
+
+    def test_concurrent_uploads_of_the_same_file(self):
+        """Test that parallel uploads of the same content share one File with a correct count"""
+        def upload(client, thread, round_):
+            upload = SimpleUploadedFile(name=f'{thread}-{round_}.txt', content=b'shared content', content_type='text/plain')
+            return client.post('/api/files/', {'file': upload}, format='multipart').status_code
+
+        self.assertEqual(self._run_in_threads(upload), [201] * THREADS * ROUNDS)
+        unique_file = File.objects.get()
+        self.assertEqual(unique_file.reference_count, THREADS * ROUNDS)
+        self.assertEqual(FileReference.objects.count(), THREADS * ROUNDS)
+
+    def test_concurrent_bulk_uploads(self):
+        """Test that parallel bulk uploads mixing shared and distinct content all succeed"""
+        def upload(client, thread, round_):
+            uploads = [
+                SimpleUploadedFile(name=f'{thread}-{round_}.txt', content=b'shared content', content_type='text/plain'),
+                SimpleUploadedFile(
+                    name=f'{thread}-{round_}-own.txt',
+                    content=f'own content {thread}-{round_}'.encode(),
+                    content_type='text/plain'
+                ),
+            ]
+            return client.post('/api/files/bulk_upload/', {'files': uploads}, format='multipart').status_code
+
+        self.assertEqual(self._run_in_threads(upload), [201] * THREADS * ROUNDS)
+        self.assertEqual(File.objects.count(), THREADS * ROUNDS + 1)
+        self.assertEqual(File.objects.get(file_hash=hashlib.sha256(b'shared content').hexdigest()).reference_count, THREADS * ROUNDS)
+        self.assertEqual(FileReference.objects.count(), THREADS * ROUNDS * 2)
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta, timezone
+from django.test import SimpleTestCase
+from files.date_time_util import datetime_to_epoch_ms, epoch_ms_to_datetime, BASE_EPOCH
+
+class DateTimeUtilTests(SimpleTestCase):
+    def test_datetime_to_epoch_ms(self):
+        """Test conversion of datetimes after the custom epoch to whole milliseconds"""
+        self.assertEqual(datetime_to_epoch_ms(BASE_EPOCH), 0)
+        self.assertEqual(
+            datetime_to_epoch_ms(datetime(2025, 4, 11, 22, 26, 1, 234567, tzinfo=timezone.utc)),
+            8720761234
+        )
+        self.assertIsNone(datetime_to_epoch_ms(None))
+
+    def test_datetime_to_epoch_ms_before_base_epoch_floors(self):
+        """Test that datetimes before 2025 round down rather than toward zero"""
+        half_ms_before = BASE_EPOCH - timedelta(microseconds=500)
+        self.assertEqual(datetime_to_epoch_ms(half_ms_before), -1)
+        self.assertEqual(
+            datetime_to_epoch_ms(datetime(2024, 12, 30, 23, 59, 59, 999500, tzinfo=timezone.utc)),
+            -86_400_001
+        )
+
+    def test_naive_and_offset_datetimes(self):
+        """Test that naive datetimes are treated as UTC and offsets are honoured"""
+        self.assertEqual(datetime_to_epoch_ms(datetime(2025, 1, 2)), 86_400_000)
+        self.assertEqual(
+            datetime_to_epoch_ms(datetime(2025, 1, 1, 5, tzinfo=timezone(timedelta(hours=5)))),
+            0
+        )
+
+    def test_round_trip(self):
+        """Test that converting back to a datetime gives the original millisecond"""
+        dt = datetime(2026, 10, 15, 8, 30, 45, 123000, tzinfo=timezone.utc)
+        self.assertEqual(epoch_ms_to_datetime(datetime_to_epoch_ms(dt)), dt)
@@ -1,9 +1,11 @@
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import transaction
-from files.models import File, FileReference, calculate_file_hash, file_upload_path
+from django.db import transaction, IntegrityError
+from files.models import File, FileReference, calculate_file_hash, file_upload_path, HASH_CHUNK_SIZE
 import hashlib
 import os
+from types import SimpleNamespace
+from unittest import mock
 
 class FileModelTests(TestCase):
     def setUp(self):
@@ -33,6 +35,21 @@ class FileModelTests(TestCase):
         
         # Assert that the file pointer is reset to position 0
         self.assertEqual(test_file.tell(), 0)
+
+    def test_calculate_file_hash_spans_multiple_chunks(self):
+        """Test that files larger than the read buffer are hashed completely"""
+        file_content = os.urandom(HASH_CHUNK_SIZE * 2 + 123)
+        # Also cover the buffered fallback used where hashlib.file_digest is unavailable (Python < 3.11)
+        without_file_digest = SimpleNamespace(sha256=hashlib.sha256)
+        for hashlib_module in [hashlib, without_file_digest]:
+            test_file = SimpleUploadedFile(
+                name='large.bin',
+                content=file_content,
+                content_type='application/octet-stream'
+            )
+            with mock.patch('files.models.hashlib', hashlib_module):
+                self.assertEqual(calculate_file_hash(test_file), hashlib.sha256(file_content).hexdigest())
+            self.assertEqual(test_file.tell(), 0)
     
     def test_file_reference_deletion_decrements_reference_count(self):
         """Test that when a FileReference is deleted, the File's reference_count is decremented"""
@@ -71,7 +88,7 @@ class FileModelTests(TestCase):
         file_obj.refresh_from_db()
         
         # Check that reference count is decremented
-        self.assertEqual(file_obj.reference_count, 2)
+        self.assertEqual(file_obj.reference_count, 1)
     
     def test_file_deletion_when_reference_count_reaches_zero(self):
         """Test that when the last FileReference is deleted, the File is also deleted"""
@@ -89,15 +106,16 @@ class FileModelTests(TestCase):
             file=test_file,
             file_type='text/plain',
             size=len(file_content),
-            reference_count=0  # Start with reference count of 1
+            reference_count=0
         )
         
         # Store the file ID
         file_id = file_obj.id
         
         # Create a FileReference instance
-        ref = FileReference.objects.get(
+        ref = FileReference.objects.create(
             reference_file=file_obj,
+            original_filename='test_deletion.txt',
         )
         
         # Delete the reference
@@ -107,6 +125,37 @@ class FileModelTests(TestCase):
         with self.assertRaises(File.DoesNotExist):
             File.objects.get(id=file_id)
 
+    def test_stored_file_removed_after_last_reference_deleted(self):
+        """Test that the physical file is removed once the deletion commits"""
+        file_content = b'This is a test file for blob cleanup'
+        test_file = SimpleUploadedFile(
+            name='test_cleanup.txt',
+            content=file_content,
+            content_type='text/plain'
+        )
+        file_obj = File.objects.create(
+            file_hash=calculate_file_hash(test_file),
+            file=test_file,
+            file_type='text/plain',
+            size=len(file_content),
+            reference_count=0
+        )
+        ref = FileReference.objects.create(
+            reference_file=file_obj,
+            original_filename='test_cleanup.txt',
+        )
+        file_path = file_obj.file.path
+        self.assertTrue(os.path.exists(file_path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ref.delete()
+            # Nothing is touched on disk until the transaction commits
+            self.assertTrue(os.path.exists(file_path))
+
+        self.assertFalse(os.path.exists(file_path))
+        self.assertFalse(os.path.exists(os.path.dirname(file_path)))
+        self.assertFalse(os.path.exists(os.path.dirname(os.path.dirname(file_path))))
+
     def test_create_file(self):
         """Test if we can create a File object"""
         test_file = SimpleUploadedFile(
@@ -126,7 +175,9 @@ class FileModelTests(TestCase):
         self.assertEqual(file_obj.file_hash, calculate_file_hash(test_file))
         self.assertEqual(file_obj.file_type, 'text/plain')
         self.assertEqual(file_obj.size, len(b'test content'))
-        self.assertEqual(file_obj.reference_count, 1)
+        # References are created explicitly, so a bare File has none
+        self.assertEqual(file_obj.reference_count, 0)
+        self.assertFalse(file_obj.references.exists())
 
     def test_create_file_reference(self):
         """Test if we can create a FileReference object"""
@@ -153,5 +204,59 @@ class FileModelTests(TestCase):
         
         self.assertEqual(file_ref.original_filename, 'original.txt')
         self.assertEqual(file_ref.reference_file, file_obj)
-        
-        
\ No newline at end of file
+
+    def test_updating_file_reference_does_not_change_reference_count(self):
+        """Test that re-saving an existing FileReference leaves the File untouched"""
+        test_file = SimpleUploadedFile(
+            name='test.txt',
+            content=b'test content test_updating_file_reference',
+            content_type='text/plain'
+        )
+        file_obj = File.objects.create(
+            file_hash=calculate_file_hash(test_file),
+            file=test_file,
+            file_type='text/plain',
+            size=len(b'test content'),
+            reference_count=0
+        )
+        file_ref = FileReference.objects.create(
+            reference_file=file_obj,
+            original_filename='original.txt'
+        )
+
+        file_ref.original_filename = 'renamed.txt'
+        with self.assertNumQueries(1):
+            file_ref.save()
+
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.reference_count, 1)
+
+    def test_duplicate_file_reference_is_rejected(self):
+        """Test that the same reference cannot be recorded twice"""
+        test_file = SimpleUploadedFile(
+            name='test.txt',
+            content=b'test content test_duplicate_file_reference',
+            content_type='text/plain'
+        )
+        file_obj = File.objects.create(
+            file_hash=calculate_file_hash(test_file),
+            file=test_file,
+            file_type='text/plain',
+            size=len(b'test content'),
+            reference_count=0
+        )
+        file_ref = FileReference.objects.create(
+            reference_file=file_obj,
+            original_filename='original.txt'
+        )
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FileReference.objects.create(
+                reference_file=file_obj,
+                original_filename='original.txt',
+                uploaded_at_epoch=file_ref.uploaded_at_epoch
+            )
+
+        # The failed insert must not leave its reference count increment behind
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.reference_count, 1)
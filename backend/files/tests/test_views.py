@@ -2,11 +2,20 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 from files.models import File, FileReference
+from files.views import FileViewSet, UPLOAD_ATTEMPTS
+from files.date_time_util import BASE_EPOCH_TIMESTAMP_MS
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db.models.query import QuerySet
+from django.conf import settings
+from unittest import mock
+import hashlib
+import os
 
 class FileViewTests(TestCase):
     def setUp(self):
         """Set up test data"""
+        cache.clear()
         self.client = APIClient()
         self.test_file = SimpleUploadedFile(
             name='test.txt',
@@ -20,7 +29,7 @@ class FileViewTests(TestCase):
             file=self.test_file,
             file_type='text/plain',
             size=len(b'test content'),
-            reference_count=1
+            reference_count=0
         )
         
         # Create a FileReference
@@ -33,7 +42,42 @@ class FileViewTests(TestCase):
         """Test getting list of files"""
         response = self.client.get('/api/files/')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_list_files_uploaded_at_is_iso_utc(self):
+        """Test that uploaded_at is rendered as an ISO 8601 UTC timestamp"""
+        self.file_ref.uploaded_at_epoch = 8720761234
+        self.file_ref.save()
+        response = self.client.get('/api/files/')
+        self.assertEqual(response.data['results'][0]['uploaded_at'], '2025-04-11T22:26:01.234Z')
+
+    def test_list_files_does_not_query_per_row(self):
+        """Test that listing joins the referenced File instead of fetching it per row"""
+        for i in range(5):
+            FileReference.objects.create(reference_file=self.file_obj, original_filename=f'copy{i}.txt')
+        # One query for the page count and one for the page itself
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/files/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(response.data['results'][0]['size'], len(b'test content'))
+
+    def test_filter_ignores_placeholder_size_bounds(self):
+        """Test that 'null'/'undefined'/'' size bounds are treated as unset"""
+        response = self.client.get('/api/files/', {'min_size': 'null', 'max_size': 'undefined'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get('/api/files/', {'min_size': '', 'max_size': len(b'test content') - 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 0)
+
+    def test_filter_by_upload_epoch(self):
+        """Test that date filters take JavaScript (1970-based) millisecond timestamps"""
+        uploaded_at_js_ms = BASE_EPOCH_TIMESTAMP_MS + self.file_ref.uploaded_at_epoch
+        response = self.client.get('/api/files/', {'date_after_epoch': uploaded_at_js_ms})
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get('/api/files/', {'date_before_epoch': uploaded_at_js_ms - 1})
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_get_storage_stats(self):
         """Test getting storage statistics"""
@@ -42,8 +86,197 @@ class FileViewTests(TestCase):
         self.assertIn('total_files', response.data)
         self.assertIn('total_references', response.data)
 
+    def test_storage_stats_values(self):
+        """Test that storage statistics reflect deduplicated references"""
+        FileReference.objects.create(reference_file=self.file_obj, original_filename='copy.txt')
+        response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_files'], 1)
+        self.assertEqual(response.data['total_references'], 2)
+        self.assertEqual(response.data['total_size'], len(b'test content'))
+        self.assertEqual(response.data['total_space_saved'], len(b'test content'))
+
+    def test_storage_stats_cached_until_data_changes(self):
+        """Test that storage statistics are served from cache and refreshed after an upload"""
+        self.client.get('/api/files/storage_stats/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.data['total_references'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FileReference.objects.create(reference_file=self.file_obj, original_filename='copy.txt')
+            # Not cleared until the change commits
+            self.assertEqual(self.client.get('/api/files/storage_stats/').data['total_references'], 1)
+        response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.data['total_references'], 2)
+        self.assertEqual(response.data['total_space_saved_readable'], '12.00 B')
+
+    def test_format_size_unit_boundaries(self):
+        """Test that sizes switch unit exactly at powers of 1024"""
+        view = FileViewSet()
+        self.assertEqual(view._format_size(0), '0.00 B')
+        self.assertEqual(view._format_size(1023), '1023.00 B')
+        self.assertEqual(view._format_size(1024), '1.00 KB')
+        self.assertEqual(view._format_size(1536 * 1024), '1.50 MB')
+        self.assertEqual(view._format_size(2048 * 1024 ** 5), '2048.00 PB')
+
+    def test_file_types_refresh_after_upload(self):
+        """Test that cached file types pick up a newly stored type"""
+        response = self.client.get('/api/files/file_types/')
+        self.assertEqual(response.data['file_types'], ['text/plain'])
+
+        upload = SimpleUploadedFile(name='image.png', content=b'not really a png', content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/files/', {'file': upload}, format='multipart')
+            # Not cleared until the upload commits
+            self.assertEqual(self.client.get('/api/files/file_types/').data['file_types'], ['text/plain'])
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/files/file_types/')
+        self.assertEqual(response.data['file_types'], ['image/png', 'text/plain'])
+        with self.assertNumQueries(0):
+            self.client.get('/api/files/file_types/')
+
     def test_deleting_file(self):
         """Test deleting a file"""
         response = self.client.delete(f'/api/files/{self.file_ref.id}/')
         self.assertEqual(response.status_code, 204)
-        
\ No newline at end of file
+
+    def test_upload_in_same_millisecond_returns_existing_reference(self):
+        """Test that an upload colliding with uniq_ref reports the recorded reference instead of failing"""
+        upload_args = dict(name='same.txt', content=b'same content', content_type='text/plain')
+        # A newer upload under the same name must not be mistaken for the colliding one
+        with mock.patch('time.time_ns', return_value=1_900_000_000_000_000_000):
+            newer = self.client.post('/api/files/', {'file': SimpleUploadedFile(**upload_args)}, format='multipart')
+        with mock.patch('time.time_ns', return_value=1_800_000_000_000_000_000):
+            first = self.client.post('/api/files/', {'file': SimpleUploadedFile(**upload_args)}, format='multipart')
+            second = self.client.post('/api/files/', {'file': SimpleUploadedFile(**upload_args)}, format='multipart')
+        self.assertEqual(newer.status_code, 201)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        unique_file = File.objects.get(file_hash=hashlib.sha256(b'same content').hexdigest())
+        self.assertEqual(unique_file.reference_count, 2)
+
+    def test_upload_retries_after_concurrent_insert(self):
+        """Test that an upload losing the insert race reuses the stored file and leaves no orphaned blob"""
+        self.file_obj.file_hash = hashlib.sha256(b'test content').hexdigest()
+        self.file_obj.save(update_fields=['file_hash'])
+        real_first = QuerySet.first
+        lookups = []
+
+        def racing_first(queryset):
+            # Pretend a concurrent upload committed the File right after the first lookup
+            if queryset.model is File:
+                lookups.append(None)
+                if len(lookups) == 1:
+                    return None
+            return real_first(queryset)
+
+        upload = SimpleUploadedFile(name='race.txt', content=b'test content', content_type='text/plain')
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=racing_first):
+            response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.file_obj.refresh_from_db()
+        self.assertEqual(self.file_obj.reference_count, 2)
+        self.assertEqual(self._stored_blobs(b'test content'), [])
+
+    def test_upload_is_hashed_while_received(self):
+        """Test that uploads are hashed by the upload handlers instead of being re-read"""
+        for content in [b'small upload', b'x' * (settings.FILE_UPLOAD_MAX_MEMORY_SIZE + 1)]:
+            upload = SimpleUploadedFile(name='hashed.bin', content=content, content_type='application/octet-stream')
+            with mock.patch('files.views.calculate_file_hash') as calculate_file_hash:
+                response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+            calculate_file_hash.assert_not_called()
+            self.assertTrue(File.objects.filter(file_hash=hashlib.sha256(content).hexdigest()).exists())
+
+    def test_uploading_duplicate_file_reuses_stored_file(self):
+        """Test that uploading the same content twice stores it once"""
+        for name in ['first.txt', 'second.txt']:
+            upload = SimpleUploadedFile(name=name, content=b'duplicate content', content_type='text/plain')
+            response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data['original_filename'], name)
+
+        self.assertEqual(File.objects.filter(size=len(b'duplicate content')).count(), 1)
+        unique_file = File.objects.get(size=len(b'duplicate content'))
+        self.assertEqual(unique_file.reference_count, 2)
+        self.assertEqual(unique_file.references.count(), 2)
+
+    def test_bulk_upload_deduplicates_files(self):
+        """Test that a bulk upload stores each distinct content once"""
+        uploads = [
+            SimpleUploadedFile(name='a.txt', content=b'bulk content a', content_type='text/plain'),
+            SimpleUploadedFile(name='b.txt', content=b'bulk content b', content_type='text/plain'),
+            SimpleUploadedFile(name='a_copy.txt', content=b'bulk content a', content_type='text/plain'),
+            SimpleUploadedFile(name='existing.txt', content=b'test content', content_type='text/plain'),
+            SimpleUploadedFile(name='a.txt', content=b'bulk content a', content_type='text/plain'),
+        ]
+        self.file_obj.file_hash = hashlib.sha256(b'test content').hexdigest()
+        self.file_obj.save(update_fields=['file_hash'])
+
+        self.client.get('/api/files/storage_stats/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/files/bulk_upload/', {'files': uploads}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/api/files/storage_stats/').data['total_files'], 3)
+        self.assertEqual(
+            [item['original_filename'] for item in response.data],
+            ['a.txt', 'b.txt', 'a_copy.txt', 'existing.txt', 'a.txt']
+        )
+        self.assertTrue(all(item['id'] for item in response.data))
+        # Same content under the same name is stored once and reported for both uploads
+        self.assertEqual(response.data[0]['id'], response.data[4]['id'])
+
+        self.assertEqual(File.objects.count(), 3)
+        duplicated_file = File.objects.get(file_hash=hashlib.sha256(b'bulk content a').hexdigest())
+        self.assertEqual(duplicated_file.reference_count, 2)
+        self.assertTrue(os.path.exists(duplicated_file.file.path))
+        self.file_obj.refresh_from_db()
+        self.assertEqual(self.file_obj.reference_count, 2)
+
+    def _race_bulk_upload(self, missed_lookups):
+        """Bulk upload existing and new content while the first lookups miss the existing File"""
+        self.file_obj.file_hash = hashlib.sha256(b'test content').hexdigest()
+        self.file_obj.save(update_fields=['file_hash'])
+        uploads = [
+            SimpleUploadedFile(name='race.txt', content=b'test content', content_type='text/plain'),
+            SimpleUploadedFile(name='fresh.txt', content=b'fresh content', content_type='text/plain'),
+        ]
+        real_in_bulk = QuerySet.in_bulk
+        lookups = []
+
+        def racing_in_bulk(queryset, *args, **kwargs):
+            # Pretend a concurrent upload committed the File right after this lookup
+            lookups.append(None)
+            if len(lookups) <= missed_lookups:
+                return {}
+            return real_in_bulk(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'in_bulk', autospec=True, side_effect=racing_in_bulk):
+            return self.client.post('/api/files/bulk_upload/', {'files': uploads}, format='multipart')
+
+    def _stored_blobs(self, content):
+        file_hash = hashlib.sha256(content).hexdigest()
+        directory = os.path.join(settings.MEDIA_ROOT, 'uploads', file_hash[:4], file_hash[4:8])
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def test_bulk_upload_retries_after_concurrent_insert(self):
+        """Test that a bulk upload losing a race re-resolves hashes without leaving orphaned blobs"""
+        response = self._race_bulk_upload(missed_lookups=1)
+        self.assertEqual(response.status_code, 201)
+        self.file_obj.refresh_from_db()
+        self.assertEqual(self.file_obj.reference_count, 2)
+        self.assertEqual(self._stored_blobs(b'test content'), [])
+        self.assertEqual(len(self._stored_blobs(b'fresh content')), 1)
+
+    def test_bulk_upload_reports_conflict_when_race_persists(self):
+        """Test that a bulk upload that keeps conflicting returns 409 and cleans up its blobs"""
+        response = self._race_bulk_upload(missed_lookups=UPLOAD_ATTEMPTS)
+        self.assertEqual(response.status_code, 409)
+        self.file_obj.refresh_from_db()
+        self.assertEqual(self.file_obj.reference_count, 1)
+        self.assertFalse(File.objects.filter(file_hash=hashlib.sha256(b'fresh content').hexdigest()).exists())
+        self.assertEqual(self._stored_blobs(b'test content'), [])
+        self.assertEqual(self._stored_blobs(b'fresh content'), [])
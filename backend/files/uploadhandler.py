@@ -0,0 +1,36 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin:
+    """
+    Compute the SHA-256 of an upload while its chunks are received, so the body
+    is not read a second time just to hash it.
+    The digest is exposed as the `sha256` attribute of the resulting UploadedFile.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Set up before super(), the memory handler raises StopFutureHandlers once it takes the file
+        self._hash = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # This handler stored the chunk, so it is the one that hashes it
+            self._hash.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self._hash.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
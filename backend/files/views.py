@@ -1,33 +1,63 @@
+from django import forms
+from django.core import validators
 from django.shortcuts import render
 from rest_framework.decorators import action
 from rest_framework import viewsets, status
 from rest_framework.response import Response
-from .models import File, calculate_file_hash, FileReference
+from .models import File, calculate_file_hash, delete_uncommitted_blob, FileReference, FILE_TYPES_CACHE_KEY, STORAGE_STATS_CACHE_KEY
 from .serializers import FileSerializer, FileReferenceSerializer
-from django.db.models import F, ExpressionWrapper, BigIntegerField, Sum
+from django.db import transaction, IntegrityError
+from django.core.cache import cache
+from django.db.models import F, ExpressionWrapper, BigIntegerField, Sum, Count
 from django.db.models.functions import Coalesce
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from django_filters import rest_framework as filters
 import logging
-from .date_time_util import datetime_to_epoch_ms, BASE_EPOCH_TIMESTAMP
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .date_time_util import BASE_EPOCH_TIMESTAMP_MS
 
 logger = logging.getLogger(__name__)
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+BULK_HASH_WORKERS = 4
+# An upload racing another upload of the same content is retried once before reporting a conflict
+UPLOAD_ATTEMPTS = 2
+
+def _lock_files(file_hashes):
+    """
+    Open an upload transaction with a write instead of a read.
+    On SQLite this no-op UPDATE takes the database write lock up front, so a concurrent upload
+    waits for it rather than failing with "database is locked" when upgrading a read lock
+    (select_for_update is a no-op there). On other databases it row-locks the existing Files.
+    """
+    File.objects.filter(file_hash__in=file_hashes).update(reference_count=F('reference_count'))
+
 # Create your views here.
 class FilesPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 50
 
+class OptionalDecimalField(forms.DecimalField):
+    # The frontend may send these placeholders for an unset bound
+    empty_values = list(validators.EMPTY_VALUES) + ['null', 'undefined']
+
+class OptionalNumberFilter(filters.NumberFilter):
+    """NumberFilter that ignores 'null'/'undefined' values instead of failing validation"""
+    field_class = OptionalDecimalField
+
 class FileFilter(filters.FilterSet):
     # Search by filename with case-insensitive contains
     filename = filters.CharFilter(field_name='original_filename', lookup_expr='icontains')
     
     # Size range filters
-    min_size = filters.NumberFilter(field_name='reference_file__size', lookup_expr='gte')
-    max_size = filters.NumberFilter(field_name='reference_file__size', lookup_expr='lte')
+    min_size = OptionalNumberFilter(field_name='reference_file__size', lookup_expr='gte')
+    max_size = OptionalNumberFilter(field_name='reference_file__size', lookup_expr='lte')
     
     # Filter by file type (exact match)
     file_type = filters.CharFilter(method='filter_file_types')
@@ -59,8 +89,7 @@ class FileFilter(filters.FilterSet):
             # JavaScript timestamp is milliseconds since 1970-01-01
             # Our custom epoch is milliseconds since 2025-01-01
             # Need to subtract the difference to convert
-            custom_epoch_ms = value - (BASE_EPOCH_TIMESTAMP * 1000)
-            return queryset.filter(uploaded_at_epoch__gte=custom_epoch_ms)
+            return queryset.filter(uploaded_at_epoch__gte=value - BASE_EPOCH_TIMESTAMP_MS)
         return queryset
     
     def filter_before_epoch(self, queryset, name, value):
@@ -69,8 +98,7 @@ class FileFilter(filters.FilterSet):
             # JavaScript timestamp is milliseconds since 1970-01-01
             # Our custom epoch is milliseconds since 2025-01-01
             # Need to subtract the difference to convert
-            custom_epoch_ms = value - (BASE_EPOCH_TIMESTAMP * 1000)
-            return queryset.filter(uploaded_at_epoch__lte=custom_epoch_ms)
+            return queryset.filter(uploaded_at_epoch__lte=value - BASE_EPOCH_TIMESTAMP_MS)
         return queryset
     
     class Meta:
@@ -88,6 +116,19 @@ class FileViewSet(viewsets.ModelViewSet):
     ordering_fields = ['uploaded_at_epoch', 'original_filename', 'reference_file__size']
     ordering = ['-uploaded_at_epoch']  # Default ordering updated
 
+    def get_queryset(self):
+        # Join the File row in the same query and load only the columns the serializer reads,
+        # so listing a page doesn't issue one extra SELECT per reference
+        return FileReference.objects.select_related('reference_file').only(
+            'id',
+            'original_filename',
+            'uploaded_at_epoch',
+            'reference_file__id',
+            'reference_file__file',
+            'reference_file__file_type',
+            'reference_file__size',
+        )
+
     def create(self, request, *args, **kwargs):
         # Check file size before uploading (10MB = 10 * 1024 * 1024 bytes)
         file_obj = request.FILES.get('file')
@@ -96,74 +137,167 @@ class FileViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check file size limit (10MB)
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
         if file_obj.size > MAX_FILE_SIZE:
-            return Response(
-                {'error': f'Maximum file size allowed is 10MB. Your file is {file_obj.size / (1024 * 1024):.2f}MB'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            return self._file_too_large_response(file_obj)
         
-        file_hash = calculate_file_hash(file_obj) if file_obj else None
+        # The upload handlers hash the file while it is received; hash it here only if they didn't
+        file_hash = getattr(file_obj, 'sha256', None) or calculate_file_hash(file_obj)
 
         if file_hash is None:
             return Response({'error': 'Could not calculate file hash'}, status=status.HTTP_400_BAD_REQUEST)
         
-        try:
-            # File exists, just create a new reference
-            unique_file = File.objects.get(file_hash=file_hash)
-            file_reference = FileReference.objects.create(
-                reference_file=unique_file,
-                original_filename=file_obj.name,
-            )
-            return Response(
-                FileReferenceSerializer(file_reference).data,
-                status=status.HTTP_201_CREATED
-            )
-        except File.DoesNotExist:
-            # This is a new unique file
-            unique_file = File.objects.create(
-                file_hash=file_hash,
-                file=file_obj,
-                file_type=file_obj.content_type,
-                size=file_obj.size,
-                reference_count=0,
-                original_filename=file_obj.name
-            )            
-            # Create a reference to this file
-            file_reference = FileReference.objects.get(
-                reference_file=unique_file,
-            )
+        for _ in range(UPLOAD_ATTEMPTS):
+            unique_file = None
+            created = False
+            attempted_epoch = None
+            try:
+                with transaction.atomic():
+                    _lock_files([file_hash])
+                    unique_file = File.objects.filter(file_hash=file_hash).first()
+                    created = unique_file is None
+                    if created:
+                        # This is a new unique file
+                        unique_file = File(
+                            file_hash=file_hash,
+                            file=file_obj,
+                            file_type=file_obj.content_type,
+                            size=file_obj.size,
+                            reference_count=0,
+                        )
+                        unique_file.save()
+                    file_reference = FileReference(
+                        reference_file=unique_file,
+                        original_filename=file_obj.name,
+                    )
+                    attempted_epoch = file_reference.uploaded_at_epoch
+                    file_reference.save()
+            except IntegrityError:
+                if created:
+                    # A concurrent upload stored this content first. Drop the blob written for
+                    # the rolled-back row and reuse the stored file
+                    delete_uncommitted_blob(unique_file)
+                    continue
+                # Same content under the same name in the same millisecond (uniq_ref):
+                # that upload is already recorded, so report it
+                file_reference = FileReference.objects.filter(
+                    reference_file=unique_file,
+                    original_filename=file_obj.name,
+                    uploaded_at_epoch=attempted_epoch,
+                ).first()
+                if file_reference is None:
+                    return Response(
+                        {'error': 'An identical upload recorded at the same moment was just removed, please retry'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                return Response(FileReferenceSerializer(file_reference).data, status=status.HTTP_200_OK)
+            
             return Response(
                 FileReferenceSerializer(file_reference).data,
                 status=status.HTTP_201_CREATED
             )
+        
+        return Response(
+            {'error': 'The file was modified by a concurrent upload, please retry'},
+            status=status.HTTP_409_CONFLICT
+        )
     
-    def list(self, request, *args, **kwargs):
-        # Log query parameters for debugging
-        logger.debug(f"Query parameters: {request.query_params}")
+    @action(detail=False, methods=['POST'])
+    def bulk_upload(self, request):
+        """
+        Upload several files sent under the 'files' key in one request.
+        Files are deduplicated against each other and against stored files,
+        then all new rows are inserted with bulk_create in a single transaction.
+        The response has one reference per uploaded file, in request order.
+        """
+        file_objs = request.FILES.getlist('files')
         
-        # Clean up query parameters
-        if hasattr(request.query_params, '_mutable'):
-            request.query_params._mutable = True
-            for param in ['min_size', 'max_size']:
-                if param in request.query_params and request.query_params[param] in ['null', 'undefined', '']:
-                    del request.query_params[param]
-            request.query_params._mutable = False
+        if not file_objs:
+            return Response({'error': 'No files provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Apply filters
-        queryset = self.filter_queryset(self.get_queryset())
+        for file_obj in file_objs:
+            if file_obj.size > MAX_FILE_SIZE:
+                return self._file_too_large_response(file_obj)
         
-        # Apply pagination
-        page = self.paginate_queryset(queryset)
+        # Files not already hashed by the upload handlers are hashed in parallel,
+        # hashlib releases the GIL while hashing
+        unhashed = [file_obj for file_obj in file_objs if getattr(file_obj, 'sha256', None) is None]
+        if unhashed:
+            with ThreadPoolExecutor(max_workers=min(len(unhashed), BULK_HASH_WORKERS)) as executor:
+                for file_obj, file_hash in zip(unhashed, executor.map(calculate_file_hash, unhashed)):
+                    file_obj.sha256 = file_hash
+        file_hashes = [file_obj.sha256 for file_obj in file_objs]
         
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        for _ in range(UPLOAD_ATTEMPTS):
+            new_files = {}
+            try:
+                with transaction.atomic():
+                    _lock_files(set(file_hashes))
+                    existing_files = File.objects.in_bulk(set(file_hashes), field_name='file_hash')
+                    new_references = defaultdict(int)
+                    file_references = []
+                    references_by_upload = {}
+                    for file_obj, file_hash in zip(file_objs, file_hashes):
+                        # The same content under the same name would share an upload timestamp,
+                        # so it is stored once and both uploads report that reference
+                        if (file_hash, file_obj.name) in references_by_upload:
+                            continue
+                        unique_file = existing_files.get(file_hash) or new_files.get(file_hash)
+                        if unique_file is None:
+                            # This is a new unique file
+                            unique_file = File(
+                                file_hash=file_hash,
+                                file=file_obj,
+                                file_type=file_obj.content_type,
+                                size=file_obj.size,
+                            )
+                            new_files[file_hash] = unique_file
+                        new_references[file_hash] += 1
+                        file_reference = FileReference(
+                            reference_file=unique_file,
+                            original_filename=file_obj.name,
+                        )
+                        references_by_upload[(file_hash, file_obj.name)] = file_reference
+                        file_references.append(file_reference)
+                    
+                    # bulk_create bypasses FileReference.save, so reference counts are set here
+                    for file_hash, unique_file in new_files.items():
+                        unique_file.reference_count = new_references[file_hash]
+                    File.objects.bulk_create(new_files.values(), batch_size=500)
+                    # bulk_create sends no post_save signals, so clear the caches once this commits
+                    transaction.on_commit(lambda: cache.delete(STORAGE_STATS_CACHE_KEY))
+                    if new_files:
+                        transaction.on_commit(lambda: cache.delete(FILE_TYPES_CACHE_KEY))
+                    
+                    # Existing files gaining the same number of references share one UPDATE
+                    existing_by_increment = defaultdict(list)
+                    for file_hash, unique_file in existing_files.items():
+                        existing_by_increment[new_references[file_hash]].append(unique_file.pk)
+                    for increment, pks in existing_by_increment.items():
+                        File.objects.filter(pk__in=pks).update(reference_count=F('reference_count') + increment)
+                    
+                    FileReference.objects.bulk_create(file_references, batch_size=1000)
+            except IntegrityError:
+                # A concurrent upload stored some of this content first. Drop the blobs written for
+                # the rolled-back rows and resolve the hashes again
+                for unique_file in new_files.values():
+                    delete_uncommitted_blob(unique_file)
+                continue
             
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-    
+            # One entry per uploaded file, in request order
+            return Response(
+                FileReferenceSerializer(
+                    [references_by_upload[(file_hash, file_obj.name)]
+                     for file_obj, file_hash in zip(file_objs, file_hashes)],
+                    many=True
+                ).data,
+                status=status.HTTP_201_CREATED
+            )
         
+        return Response(
+            {'error': 'The files were modified by a concurrent upload, please retry'},
+            status=status.HTTP_409_CONFLICT
+        )
+    
     @action(detail=False, methods=['GET'])
     def storage_stats(self, request):
         """
@@ -174,43 +308,58 @@ class FileViewSet(viewsets.ModelViewSet):
             - total_size: Total size of unique files
             - total_space_saved: Space saved through deduplication
         """
-        space_saved = File.objects.aggregate(
-            saved=Sum(
-                ExpressionWrapper(
-                    F('size') * (F('reference_count') - 1),
-                    output_field=BigIntegerField()
-                )
-            )
-        )['saved'] or 0
-        stats = {
-            'total_files': File.objects.count(),
-            'total_references': FileReference.objects.count(),
-            'total_size': File.objects.aggregate(
-                total=Coalesce(Sum('size'), 0)
-            )['total'],
-            'total_space_saved': space_saved,
-        }
+        # The whole response body is cached, and dropped by signal handlers once a change commits
+        stats = cache.get(STORAGE_STATS_CACHE_KEY)
+        if stats is None:
+            stats = self._compute_storage_stats()
             
-        # Convert bytes to more readable format
-        stats['total_size_readable'] = self._format_size(stats['total_size'])
-        stats['total_space_saved_readable'] = self._format_size(stats['total_space_saved'])
+            # Convert bytes to more readable format
+            stats['total_size_readable'] = self._format_size(stats['total_size'])
+            stats['total_space_saved_readable'] = self._format_size(stats['total_space_saved'])
+            cache.set(STORAGE_STATS_CACHE_KEY, stats, 15)
         
         return Response(stats)
     
+    def _compute_storage_stats(self):
+        """Compute all storage statistics in a single aggregate query over File"""
+        return File.objects.aggregate(
+            total_files=Count('id'),
+            # Every reference is counted on its File, so there is no need to query FileReference
+            total_references=Coalesce(Sum('reference_count'), 0),
+            total_size=Coalesce(Sum('size'), 0),
+            total_space_saved=Coalesce(
+                Sum(
+                    ExpressionWrapper(
+                        F('size') * (F('reference_count') - 1),
+                        output_field=BigIntegerField()
+                    )
+                ),
+                0
+            ),
+        )
+    
     @action(detail=False, methods=['GET'])
     def file_types(self, request):
         """Get all unique file types for filtering"""
-        # Get unique file types by accessing through the relationship
-        file_types = FileReference.objects.values_list(
-            'reference_file__file_type', flat=True
-        ).distinct().order_by('reference_file__file_type')
+        # Every stored File has at least one reference, so File can be queried directly without a JOIN
+        file_types = cache.get_or_set(
+            FILE_TYPES_CACHE_KEY,
+            lambda: list(
+                File.objects.values_list('file_type', flat=True).distinct().order_by('file_type')
+            ),
+            3600
+        )
         
-        return Response({"file_types": list(file_types)})
+        return Response({"file_types": file_types})
+    
+    def _file_too_large_response(self, file_obj):
+        return Response(
+            {'error': f'Maximum file size allowed is 10MB. Your file is {file_obj.size / (1024 * 1024):.2f}MB'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     def _format_size(self, size_in_bytes):
         """Convert bytes to human readable format"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_in_bytes < 1024:
-                return f"{size_in_bytes:.2f} {unit}"
-            size_in_bytes /= 1024
-        return f"{size_in_bytes:.2f} PB"
+        # Each unit is 2**10 times the previous one, so the unit index follows from the bit length
+        idx = min(max(int(size_in_bytes).bit_length() - 1, 0) // 10, len(_SIZE_UNITS) - 1)
+        return f"{size_in_bytes / (1 << (idx * 10)):.2f} {_SIZE_UNITS[idx]}"